@@ -12,7 +12,7 @@ async def test_full():
     task_id = "TESTING"
     keyword = "Espresso Machine"
     
-    async def progress_cb(tid, stage, status, message, url=None):
+    async def progress_cb(tid, stage, status, message, url=None, variants=None):
         print(f"[{stage}] {status}: {message} (URL: {url})")
 
     try:
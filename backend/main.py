@@ -4,27 +4,37 @@
 """
 
 import os
+import hmac
+import json
+import time
 import uuid
 import asyncio
 from pathlib import Path
 from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
-
-from schemas import (
-    GenerateRequest, GenerateResponse, StatusResponse,
-    StageResult, PipelineStage
-)
-from services.google_ai import run_full_pipeline
+from pydantic import ValidationError
 
 # ── 환경 설정 ──
 # .env 파일 로드 (로컬 개발용)
+# services.*는 import 시점에 환경 변수를 읽으므로 반드시 그보다 먼저 로드
 load_dotenv()
 
+from schemas import (  # noqa: E402
+    GenerateRequest, GenerateResponse, StatusResponse, CancelResponse,
+    StageResult, WatchdogConfig, VariantResult
+)
+from services.google_ai import run_full_pipeline, ZONE1_STATS  # noqa: E402
+from services.task_state import STAGE_ORDER, new_task_record, apply_progress  # noqa: E402
+from services.loop_monitor import (  # noqa: E402
+    watchdog, install_thread_pool, thread_pool_snapshot, follow_control, publish_control,
+    apply_control, LOOP_WATCHDOG_ENABLED
+)
+
 # 경로 설정: 환경 변수에서 가져오거나 기본값 사용
 BASE_DIR = Path(__file__).resolve().parent
 OUTPUTS_DIR = Path(os.getenv("OUTPUTS_DIR", BASE_DIR / "outputs"))
@@ -33,43 +43,49 @@ ASSETS_DIR = Path(os.getenv("ASSETS_DIR", BASE_DIR / "assets"))
 OUTPUTS_DIR.mkdir(exist_ok=True, parents=True)
 ASSETS_DIR.mkdir(exist_ok=True, parents=True)
 
+# 실행 모드: "inprocess"(API 서버가 직접 공정 실행) 또는 "broker"(워커에게 위임)
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "inprocess")
+broker = None
+if PIPELINE_MODE == "broker":
+    from services.broker import get_broker
+    broker = get_broker()
+
+
+# 관리자 엔드포인트 보호용 토큰 (X-Admin-Token 헤더). 설정하지 않으면 관리자 엔드포인트는 닫힘
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# 이 시간(초) 동안 아무도 현황을 조회하지 않은 공사는 자동 취소 (0이면 비활성)
+TASK_ABANDON_SECONDS = float(os.getenv("TASK_ABANDON_SECONDS", "600"))
+
 
 # ── 작업 상태 저장소 (인메모리) ──
 task_store: dict[str, dict] = {}
+running_tasks: dict[str, asyncio.Task] = {}
 
 
-async def progress_callback(task_id, stage, status, message, output_url=None):
+async def progress_callback(task_id, stage, status, message, output_url=None, variants=None):
     """실시간 공사 현황 업데이트"""
     if task_id not in task_store:
         return
-    task_store[task_id]["stages"][stage] = {
-        "stage": stage,
-        "status": status,
-        "message": message,
-        "output_url": output_url,
-    }
-    # 진행률 계산
-    stage_order = ["market_research", "image_generation", "image_synthesis", "video_generation"]
-    completed = sum(
-        1 for s in stage_order
-        if s in task_store[task_id]["stages"]
-        and task_store[task_id]["stages"][s]["status"] in ("completed", "skipped")
-    )
-    task_store[task_id]["progress"] = int((completed / len(stage_order)) * 100)
-
-    if status == "completed" and stage == "video_generation":
-        task_store[task_id]["current_stage"] = PipelineStage.COMPLETED
-        task_store[task_id]["final_video_url"] = output_url
-    elif status == "failed":
-        task_store[task_id]["current_stage"] = PipelineStage.FAILED
-    elif status == "running":
-        stage_map = {
-            "market_research": PipelineStage.MARKET_RESEARCH,
-            "image_generation": PipelineStage.IMAGE_GENERATION,
-            "image_synthesis": PipelineStage.IMAGE_SYNTHESIS,
-            "video_generation": PipelineStage.VIDEO_GENERATION,
-        }
-        task_store[task_id]["current_stage"] = stage_map.get(stage, PipelineStage.IDLE)
+    apply_progress(task_store[task_id], stage, status, message, output_url, variants)
+
+
+async def reap_abandoned_tasks():
+    """방치된 공사 순찰: 클라이언트가 떠난 작업을 취소해 자원을 돌려받습니다."""
+    interval = min(60.0, TASK_ABANDON_SECONDS / 4)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if broker is not None:
+                await asyncio.to_thread(broker.cancel_abandoned, TASK_ABANDON_SECONDS)
+                continue
+            cutoff = time.monotonic() - TASK_ABANDON_SECONDS
+            for task_id, task in list(running_tasks.items()):
+                if not task.done() and task_store[task_id]["last_polled"] < cutoff:
+                    print(f"🧹 방치된 공사 취소: {task_id}")
+                    task.cancel()
+        except Exception as e:
+            print(f"⚠️ 순찰 중 지진 감지: {e}")
 
 
 # ── FastAPI 앱 생성 ──
@@ -78,7 +94,20 @@ async def lifespan(app: FastAPI):
     print("🏙️ AI City Builders 발전소 가동 시작!")
     print(f"📁 완제품 저장소: {OUTPUTS_DIR}")
     print(f"📁 원자재 저장소: {ASSETS_DIR}")
+    print(f"🚚 실행 모드: {PIPELINE_MODE}")
+    install_thread_pool(asyncio.get_running_loop())
+    if LOOP_WATCHDOG_ENABLED:
+        watchdog.start()
+    # gunicorn 워커마다 감시기가 따로 있으므로 관리자 명령은 제어 파일로 전달받음
+    watchdog_control = asyncio.create_task(follow_control())
+    reaper = None
+    if TASK_ABANDON_SECONDS > 0:
+        reaper = asyncio.create_task(reap_abandoned_tasks())
     yield
+    if reaper is not None:
+        reaper.cancel()
+    watchdog_control.cancel()
+    watchdog.stop()
     print("🏙️ 발전소 가동 중지. 안녕히!")
 
 app = FastAPI(
@@ -115,6 +144,9 @@ async def root():
         "endpoints": {
             "generate": "POST /generate",
             "status": "GET /status/{task_id}",
+            "cancel": "DELETE /tasks/{task_id}",
+            "metrics": "GET /metrics",
+            "watchdog": "GET|POST /admin/watchdog",
             "outputs": "GET /outputs/{filename}",
         }
     }
@@ -125,12 +157,28 @@ async def generate(
     product_keyword: str = Form(...),
     style_prompt: str = Form("modern, sleek, professional product photography"),
     video_prompt_hint: str = Form("smooth camera movement, cinematic lighting"),
+    deadline_seconds: float | None = Form(None, gt=0),
+    variants: str | None = Form(None),
     character_image: UploadFile | None = File(None),
 ):
     """
     🏗️ 전체 공정 시작!
     캐릭터 이미지(선택)와 키워드로 영상을 생성합니다.
+    variants: 출력 변형 JSON 목록 (예: '[{"aspect_ratio": "16:9", "takes": 2}]')
     """
+    # 주문서 검문 (키워드, 출력 변형 등 어느 필드가 틀렸는지는 오류 내용에 표시)
+    try:
+        request = GenerateRequest(
+            product_keyword=product_keyword,
+            style_prompt=style_prompt,
+            video_prompt_hint=video_prompt_hint,
+            deadline_seconds=deadline_seconds,
+            variants=json.loads(variants) if variants else [{}],
+        )
+    except (ValueError, ValidationError) as e:
+        raise HTTPException(status_code=422, detail=f"요청 규격 오류: {e}")
+    variant_list = [v.model_dump() for v in request.variants]
+
     task_id = str(uuid.uuid4())[:8]
 
     # 캐릭터 이미지 저장
@@ -141,14 +189,26 @@ async def generate(
             content = await character_image.read()
             f.write(content)
 
+    # 워커 모드: 물류 센터에 작업 지시서만 맡기고 바로 응답
+    if broker is not None:
+        payload = {
+            "keyword": product_keyword,
+            "character_image_path": char_path,
+            "style_prompt": style_prompt,
+            "video_hint": video_prompt_hint,
+            "deadline_seconds": deadline_seconds,
+            "variants": variant_list,
+        }
+        await asyncio.to_thread(broker.enqueue, task_id, payload, new_task_record())
+        return GenerateResponse(
+            task_id=task_id,
+            status="accepted",
+            message=f"🏗️ 공사가 접수되었습니다! Task ID: {task_id}"
+        )
+
     # 작업 등록
-    task_store[task_id] = {
-        "current_stage": PipelineStage.IDLE,
-        "progress": 0,
-        "stages": {},
-        "final_video_url": None,
-        "metadata": None,
-    }
+    task_store[task_id] = new_task_record()
+    task_store[task_id]["last_polled"] = time.monotonic()
 
     # 비동기 파이프라인 실행
     async def _run():
@@ -160,12 +220,18 @@ async def generate(
                 style_prompt=style_prompt,
                 video_hint=video_prompt_hint,
                 progress_callback=progress_callback,
+                deadline_seconds=deadline_seconds,
+                variants=variant_list,
             )
             task_store[task_id]["metadata"] = result.get("metadata")
+        except asyncio.CancelledError:
+            print(f"🛑 공사 취소: {task_id}")
         except Exception as e:
             print(f"🚨 공정 중 지진 발생: {e}")
+        finally:
+            running_tasks.pop(task_id, None)
 
-    asyncio.create_task(_run())
+    running_tasks[task_id] = asyncio.create_task(_run())
 
     return GenerateResponse(
         task_id=task_id,
@@ -177,10 +243,15 @@ async def generate(
 @app.get("/status/{task_id}", response_model=StatusResponse)
 async def get_status(task_id: str):
     """📊 공사 현황 조회"""
-    if task_id not in task_store:
+    if broker is not None:
+        task = await asyncio.to_thread(broker.get_state, task_id)
+    else:
+        task = task_store.get(task_id)
+        if task is not None:
+            task["last_polled"] = time.monotonic()
+    if task is None:
         raise HTTPException(status_code=404, detail="해당 공사 현장을 찾을 수 없습니다.")
 
-    task = task_store[task_id]
     stages = [
         StageResult(
             stage=s,
@@ -188,7 +259,7 @@ async def get_status(task_id: str):
             message=task["stages"].get(s, {}).get("message", "대기 중"),
             output_url=task["stages"].get(s, {}).get("output_url"),
         )
-        for s in ["market_research", "image_generation", "image_synthesis", "video_generation"]
+        for s in STAGE_ORDER
     ]
 
     return StatusResponse(
@@ -197,10 +268,71 @@ async def get_status(task_id: str):
         progress=task["progress"],
         stages=stages,
         final_video_url=task.get("final_video_url"),
+        variants=[VariantResult(**v) for v in task.get("variants", [])],
         metadata=task.get("metadata"),
     )
 
 
+@app.delete("/tasks/{task_id}", response_model=CancelResponse)
+async def cancel_task(task_id: str):
+    """🛑 공사 중단 (원격 Veo 작업도 가능한 경우 함께 중단)"""
+    if broker is not None:
+        accepted = await asyncio.to_thread(broker.request_cancel, task_id)
+    elif task_id not in task_store:
+        accepted = None
+    else:
+        task = running_tasks.get(task_id)
+        accepted = task is not None and not task.done()
+        if accepted:
+            task.cancel()
+
+    if accepted is None:
+        raise HTTPException(status_code=404, detail="해당 공사 현장을 찾을 수 없습니다.")
+    if not accepted:
+        raise HTTPException(status_code=409, detail="이미 끝난 공사입니다.")
+    return CancelResponse(task_id=task_id)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """📈 계기판 (워커 모드에서는 모든 워커의 합계)"""
+    if broker is not None:
+        metrics = await asyncio.to_thread(broker.get_metrics)
+        metrics.setdefault("zone1", {})
+        return metrics
+    return {"zone1": dict(ZONE1_STATS)}
+
+
+def check_admin(token: str | None):
+    """관리자 출입증 확인 (토큰 미설정 시 존재 자체를 숨김)"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if token is None or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="관리자 출입증이 필요합니다.")
+
+
+@app.get("/admin/watchdog")
+async def get_watchdog(x_admin_token: str | None = Header(None)):
+    """🩺 이벤트 루프 상태 및 스레드 풀 현황 (요청을 받은 프로세스 기준, loop.pid 참고)"""
+    check_admin(x_admin_token)
+    return {"loop": watchdog.snapshot(), "thread_pool": thread_pool_snapshot()}
+
+
+@app.post("/admin/watchdog")
+async def set_watchdog(config: WatchdogConfig, x_admin_token: str | None = Header(None)):
+    """🩺 루프 감시 켜기/끄기 (재시작 없이, 같은 호스트의 모든 프로세스에 전파)"""
+    check_admin(x_admin_token)
+    control = await asyncio.to_thread(
+        publish_control, config.enabled, config.threshold_ms if config.enabled else None
+    )
+    apply_control(control)
+    return {
+        "loop": watchdog.snapshot(),
+        "thread_pool": thread_pool_snapshot(),
+        "control": control,
+    }
+
+
 @app.get("/download/{task_id}/{filename}")
 async def download_file(task_id: str, filename: str):
     """📥 완제품 다운로드"""
@@ -3,8 +3,8 @@
 불량 자재가 도시에 들어오지 못하게 하는 검문소입니다.
 """
 
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, Field, field_validator
+from typing import Literal, Optional
 from enum import Enum
 
 
@@ -17,6 +17,13 @@ class PipelineStage(str, Enum):
     VIDEO_GENERATION = "video_generation"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class OutputVariant(BaseModel):
+    """출력 변형 - 화면비별 촬영 주문"""
+    aspect_ratio: Literal["9:16", "16:9"] = Field("9:16", description="영상 화면비")
+    takes: int = Field(1, ge=1, le=4, description="이 화면비로 찍을 영상 수")
 
 
 class GenerateRequest(BaseModel):
@@ -30,6 +37,23 @@ class GenerateRequest(BaseModel):
         default="smooth camera movement, cinematic lighting",
         description="영상 연출 힌트"
     )
+    deadline_seconds: Optional[float] = Field(
+        default=None, gt=0, description="전체 공정 제한 시간 (초, 기본값은 서버 설정)"
+    )
+    variants: list[OutputVariant] = Field(
+        default_factory=lambda: [OutputVariant()],
+        min_length=1, max_length=2,
+        description="출력 변형 목록 (화면비당 하나, Zone 1~3은 한 번만 실행)"
+    )
+
+    @field_validator("variants")
+    @classmethod
+    def unique_aspect_ratios(cls, variants: list[OutputVariant]) -> list[OutputVariant]:
+        """같은 화면비는 한 번만 (촬영 수는 takes로 지정)"""
+        ratios = [v.aspect_ratio for v in variants]
+        if len(ratios) != len(set(ratios)):
+            raise ValueError("같은 화면비를 여러 번 지정할 수 없습니다. takes로 촬영 수를 늘리세요.")
+        return variants
 
 
 class StageResult(BaseModel):
@@ -40,6 +64,13 @@ class StageResult(BaseModel):
     output_url: Optional[str] = None
 
 
+class VariantResult(BaseModel):
+    """변형별 완제품"""
+    aspect_ratio: str
+    take: int
+    url: str
+
+
 class GenerateResponse(BaseModel):
     """생성 응답 - 작업 접수증"""
     task_id: str
@@ -47,6 +78,19 @@ class GenerateResponse(BaseModel):
     message: str = "공사가 시작되었습니다! 🏗️"
 
 
+class CancelResponse(BaseModel):
+    """취소 응답 - 공사 중단 접수증"""
+    task_id: str
+    status: str = "cancelling"
+    message: str = "공사 중단을 요청했습니다. 🛑"
+
+
+class WatchdogConfig(BaseModel):
+    """루프 감시 설정 변경 요청"""
+    enabled: bool
+    threshold_ms: Optional[float] = Field(None, gt=0, description="막힘 판정 임계값 (ms)")
+
+
 class StatusResponse(BaseModel):
     """상태 응답 - 실시간 공사 현황"""
     task_id: str
@@ -54,4 +98,15 @@ class StatusResponse(BaseModel):
     progress: int = Field(0, ge=0, le=100, description="전체 진행률 (%)")
     stages: list[StageResult] = []
     final_video_url: Optional[str] = None
+    variants: list[VariantResult] = []
     metadata: Optional[dict] = None
+
+
+class MarketResearch(BaseModel):
+    """Zone 1 시장 조사 결과 - 모델 응답 규격 (response_schema)"""
+    title: str = Field(..., description="매력적인 한국어 제목 (50자 이내)")
+    description: str = Field(..., description="SEO 최적화 한국어 설명 (200자 이내)")
+    tags: list[str] = Field(default_factory=list, description="한국어 태그 5개")
+    trend_summary: str = Field("", description="현재 이 제품의 트렌드 요약 (100자 이내)")
+    product_description: str = Field(..., description="영상에 사용할 제품 상세 설명 (영어, 50단어 이내)")
+    scene_description: str = Field(..., description="제품을 보여줄 영상 장면 설명 (영어, 50단어 이내)")
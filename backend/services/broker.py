@@ -0,0 +1,418 @@
+"""
+📮 AI City Builders - 물류 센터 (Job Broker)
+API 서버(접수 창구)와 워커(공장) 사이에서 작업 지시서를 주고받는 우체국입니다.
+
+- API 노드는 enqueue()로 작업을 맡기고 get_state()로 현황을 조회합니다.
+- 워커는 claim()으로 작업을 임대(lease)받고, heartbeat()로 임대를 연장하며,
+  publish_progress()로 공정 현황을 되돌려 보냅니다.
+- 임대가 만료된 작업(워커 사망)은 다른 워커가 다시 가져갑니다.
+- request_cancel()로 취소를 요청하면 대기 중인 작업은 즉시 취소되고,
+  진행 중인 작업은 워커의 다음 heartbeat()가 실패하면서 중단됩니다.
+
+Broker 인터페이스를 구현하면 다른 저장소(Redis 등)로 교체할 수 있습니다.
+기본 구현은 SQLite(WAL)이며 한 호스트 안의 프로세스끼리만 안전하게 공유됩니다.
+WAL은 공유 메모리 인덱스를 쓰므로 NFS 같은 네트워크 볼륨에 DB를 두면 안 됩니다.
+여러 노드로 늘리려면 네트워크 저장소를 쓰는 Broker 구현이 필요합니다.
+"""
+
+import os
+import json
+import time
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from schemas import PipelineStage
+from services.task_state import apply_progress, new_task_record
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+BROKER_DB_PATH = Path(os.getenv("BROKER_DB_PATH", BASE_DIR / "broker.db"))
+BROKER_MAX_ATTEMPTS = int(os.getenv("BROKER_MAX_ATTEMPTS", "3"))
+
+
+@dataclass
+class Job:
+    """임대받은 작업 지시서"""
+    job_id: str
+    payload: dict
+    attempts: int
+
+
+class Broker(ABC):
+    """물류 센터 규격 (교체 가능한 인터페이스)"""
+
+    @abstractmethod
+    def enqueue(self, job_id: str, payload: dict, state: dict) -> None:
+        """작업 접수"""
+
+    @abstractmethod
+    def claim(self, worker_id: str, lease_seconds: float) -> Optional[Job]:
+        """대기 중이거나 임대가 만료된 작업 하나를 임대"""
+
+    @abstractmethod
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """임대 연장. 임대를 잃었으면 False"""
+
+    @abstractmethod
+    def publish_progress(
+        self, job_id: str, worker_id: str, stage, status, message, output_url=None,
+        variants=None,
+    ) -> bool:
+        """공정 현황 보고. 임대를 잃었으면 False"""
+
+    @abstractmethod
+    def complete(self, job_id: str, worker_id: str, metadata: Optional[dict]) -> bool:
+        """작업 완료 처리"""
+
+    @abstractmethod
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        """작업 실패 처리 (재시도하지 않음)"""
+
+    @abstractmethod
+    def release(self, job_id: str, worker_id: str) -> bool:
+        """
+        작업을 대기열로 되돌리고 현황을 대기 상태로 초기화 (워커 종료 시).
+        취소 요청된 작업은 취소로 마감
+        """
+
+    @abstractmethod
+    def request_cancel(self, job_id: str) -> Optional[bool]:
+        """취소 요청. 없는 작업이면 None, 이미 끝난 작업이면 False"""
+
+    @abstractmethod
+    def cancel_abandoned(self, idle_seconds: float) -> int:
+        """idle_seconds 동안 아무도 조회하지 않은 작업 취소. 취소한 개수 반환"""
+
+    @abstractmethod
+    def get_state(self, job_id: str) -> Optional[dict]:
+        """공사 현황 레코드 조회 (조회 시각도 기록)"""
+
+    @abstractmethod
+    def publish_metrics(self, worker_id: str, metrics: dict) -> None:
+        """워커 계기판 값 보고 (누적값 스냅샷으로 덮어씀)"""
+
+    @abstractmethod
+    def get_metrics(self) -> dict:
+        """모든 워커의 계기판 값 합계"""
+
+
+class SQLiteBroker(Broker):
+    """SQLite 기반 물류 센터"""
+
+    def __init__(self, db_path=BROKER_DB_PATH, max_attempts: int = BROKER_MAX_ATTEMPTS):
+        self.db_path = str(db_path)
+        self.max_attempts = max_attempts
+        Path(self.db_path).parent.mkdir(exist_ok=True, parents=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    last_polled REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            # 이전 버전 DB 보강
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "cancel_requested" not in columns:
+                conn.execute(
+                    "ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0"
+                )
+            if "last_polled" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN last_polled REAL")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)"
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS worker_metrics (
+                    worker_id TEXT PRIMARY KEY,
+                    metrics TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # 스레드마다 새 연결 (asyncio.to_thread에서 호출되므로)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, job_id, payload, state):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, payload, state, last_polled, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, json.dumps(payload), json.dumps(state), now, now, now),
+            )
+
+    def claim(self, worker_id, lease_seconds):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # 취소 처리 중 워커가 사라진 작업은 취소로 마감
+            abandoned = conn.execute(
+                "SELECT job_id, state FROM jobs WHERE status = 'running' "
+                "AND lease_expires < ? AND cancel_requested = 1",
+                (now,),
+            ).fetchall()
+            for row in abandoned:
+                state = json.loads(row["state"])
+                state["current_stage"] = PipelineStage.CANCELLED
+                conn.execute(
+                    "UPDATE jobs SET status = 'cancelled', worker_id = NULL, state = ?, "
+                    "updated_at = ? WHERE job_id = ?",
+                    (json.dumps(state), now, row["job_id"]),
+                )
+            # 재시도 한도를 넘긴 채 임대가 만료된 작업은 폐기
+            expired = conn.execute(
+                "SELECT job_id, state FROM jobs WHERE status = 'running' "
+                "AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            ).fetchall()
+            for row in expired:
+                state = json.loads(row["state"])
+                stage = next(
+                    (s for s, v in state["stages"].items() if v["status"] == "running"),
+                    "unknown",
+                )
+                apply_progress(
+                    state, stage, "failed",
+                    f"🚨 워커 응답 없음 ({self.max_attempts}회 임대 만료)",
+                )
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', worker_id = NULL, state = ?, "
+                    "updated_at = ? WHERE job_id = ?",
+                    (json.dumps(state), now, row["job_id"]),
+                )
+
+            row = conn.execute(
+                "SELECT job_id, payload, attempts FROM jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            attempts = row["attempts"] + 1
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker_id = ?, lease_expires = ?, "
+                "attempts = ?, updated_at = ? WHERE job_id = ?",
+                (worker_id, now + lease_seconds, attempts, now, row["job_id"]),
+            )
+            conn.execute("COMMIT")
+            return Job(job_id=row["job_id"], payload=json.loads(row["payload"]), attempts=attempts)
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def heartbeat(self, job_id, worker_id, lease_seconds):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? "
+                "WHERE job_id = ? AND worker_id = ? AND status = 'running' "
+                "AND cancel_requested = 0",
+                (now + lease_seconds, now, job_id, worker_id),
+            )
+            return cur.rowcount == 1
+
+    def _update_owned(self, job_id, worker_id, mutate, new_status=None) -> bool:
+        """임대 중인 작업의 레코드를 원자적으로 갱신"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT state FROM jobs WHERE job_id = ? AND worker_id = ? AND status = 'running'",
+                (job_id, worker_id),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return False
+            state = json.loads(row["state"])
+            mutate(state)
+            if new_status is None:
+                conn.execute(
+                    "UPDATE jobs SET state = ?, updated_at = ? WHERE job_id = ?",
+                    (json.dumps(state), time.time(), job_id),
+                )
+            else:
+                conn.execute(
+                    "UPDATE jobs SET state = ?, status = ?, worker_id = NULL, "
+                    "updated_at = ? WHERE job_id = ?",
+                    (json.dumps(state), new_status, time.time(), job_id),
+                )
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def publish_progress(
+        self, job_id, worker_id, stage, status, message, output_url=None, variants=None
+    ):
+        return self._update_owned(
+            job_id, worker_id,
+            lambda state: apply_progress(state, stage, status, message, output_url, variants),
+        )
+
+    def complete(self, job_id, worker_id, metadata):
+        def _mutate(state):
+            state["metadata"] = metadata
+        return self._update_owned(job_id, worker_id, _mutate, new_status="done")
+
+    def fail(self, job_id, worker_id, error):
+        def _mutate(state):
+            state["error"] = error
+        return self._update_owned(job_id, worker_id, _mutate, new_status="failed")
+
+    def release(self, job_id, worker_id):
+        # 워커가 스스로 반납한 작업은 재시도 횟수에서 제외
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT state, cancel_requested FROM jobs "
+                "WHERE job_id = ? AND worker_id = ? AND status = 'running'",
+                (job_id, worker_id),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return False
+            if row["cancel_requested"]:
+                # 취소 요청으로 중단된 작업: 취소로 마감
+                new_status = "cancelled"
+                state = json.loads(row["state"])
+                state["current_stage"] = PipelineStage.CANCELLED
+            else:
+                # drain 등으로 반납된 작업: 처음부터 다시 하므로 현황도 대기 상태로
+                new_status = "queued"
+                state = new_task_record()
+            conn.execute(
+                "UPDATE jobs SET status = ?, state = ?, worker_id = NULL, "
+                "lease_expires = NULL, attempts = MAX(attempts - 1, 0), updated_at = ? "
+                "WHERE job_id = ?",
+                (new_status, json.dumps(state), now, job_id),
+            )
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def request_cancel(self, job_id):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT status, state FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            if row["status"] == "queued":
+                # 아직 착공 전: 바로 취소
+                state = json.loads(row["state"])
+                state["current_stage"] = PipelineStage.CANCELLED
+                conn.execute(
+                    "UPDATE jobs SET status = 'cancelled', cancel_requested = 1, state = ?, "
+                    "updated_at = ? WHERE job_id = ?",
+                    (json.dumps(state), now, job_id),
+                )
+            elif row["status"] == "running":
+                conn.execute(
+                    "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE job_id = ?",
+                    (now, job_id),
+                )
+            else:
+                conn.execute("COMMIT")
+                return False
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def cancel_abandoned(self, idle_seconds):
+        cutoff = time.time() - idle_seconds
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT job_id FROM jobs WHERE status IN ('queued', 'running') "
+                "AND cancel_requested = 0 AND last_polled < ?",
+                (cutoff,),
+            ).fetchall()
+        cancelled = 0
+        for row in rows:
+            if self.request_cancel(row["job_id"]):
+                print(f"🧹 방치된 공사 취소: {row['job_id']}")
+                cancelled += 1
+        return cancelled
+
+    def get_state(self, job_id):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET last_polled = ? WHERE job_id = ?", (time.time(), job_id)
+            )
+            row = conn.execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row["state"]) if row else None
+
+
+    def publish_metrics(self, worker_id, metrics):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO worker_metrics (worker_id, metrics, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET metrics = excluded.metrics, "
+                "updated_at = excluded.updated_at",
+                (worker_id, json.dumps(metrics), time.time()),
+            )
+
+    def get_metrics(self):
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT metrics FROM worker_metrics").fetchall()
+        totals: dict[str, dict] = {}
+        for row in rows:
+            for group, counters in json.loads(row["metrics"]).items():
+                bucket = totals.setdefault(group, {})
+                for name, value in counters.items():
+                    bucket[name] = bucket.get(name, 0) + value
+        return totals
+
+
+def get_broker() -> Broker:
+    """환경변수(BROKER_BACKEND)에 맞는 물류 센터 연결"""
+    backend = os.getenv("BROKER_BACKEND", "sqlite")
+    if backend == "sqlite":
+        return SQLiteBroker()
+    raise RuntimeError(f"🚨 지원하지 않는 물류 센터입니다: {backend}")
@@ -10,6 +10,7 @@
 """
 
 import os
+import json
 import time
 import base64
 import asyncio
@@ -22,6 +23,8 @@ from google.genai import types
 from PIL import Image
 import io
 
+from schemas import MarketResearch
+
 # ── 발전소 설비 초기화 ──
 # main.py와 동일한 방식으로 경로를 설정합니다. 가급적 환경변수를 통해 제어합니다.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -33,6 +36,35 @@ ASSETS_DIR.mkdir(exist_ok=True, parents=True)
 
 
 MAX_RETRIES = 5  # 내진 설계 강화: 5회 재시도
+
+
+def veo_max_videos_per_request() -> int:
+    """Veo 요청 한 번에 묶어 찍을 최대 영상 수 (모델이 number_of_videos를 지원하는 만큼)"""
+    return max(int(os.getenv("VEO_MAX_VIDEOS_PER_REQUEST", "1")), 1)
+
+
+# ── 공기(제한 시간) 설정 ──
+# API 서버와 워커가 같은 값을 쓰도록 import 시점이 아니라 사용 시점에 읽습니다.
+STAGE_DEADLINE_ENV = {
+    "market_research": ("MARKET_RESEARCH_DEADLINE_SECONDS", "120"),
+    "image_generation": ("IMAGE_GENERATION_DEADLINE_SECONDS", "300"),
+    "image_synthesis": ("IMAGE_SYNTHESIS_DEADLINE_SECONDS", "300"),
+    "video_generation": ("VIDEO_GENERATION_DEADLINE_SECONDS", "900"),
+}
+
+
+def task_deadline_seconds() -> float:
+    """전체 공정 제한 시간 (TASK_DEADLINE_SECONDS)"""
+    return float(os.getenv("TASK_DEADLINE_SECONDS", "1800"))
+
+
+def stage_deadlines() -> dict:
+    """단계별 제한 시간"""
+    return {
+        stage: float(os.getenv(name, default))
+        for stage, (name, default) in STAGE_DEADLINE_ENV.items()
+    }
+
 SAFETY_SETTINGS = [
     {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
     {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
@@ -56,8 +88,11 @@ def get_client():
 
 
 
-async def retry_async(func, *args, **kwargs):
-    """내진 설계: 최대 3회 재시도"""
+async def retry_async(func, *args, on_retry=None, **kwargs):
+    """
+    내진 설계: 최대 MAX_RETRIES회 재시도
+    on_retry(attempt, error): 실제로 재시도할 때마다 호출 (마지막 실패는 제외)
+    """
     last_error = None
     for attempt in range(1, MAX_RETRIES + 1):
         try:
@@ -66,48 +101,179 @@ async def retry_async(func, *args, **kwargs):
             last_error = e
             print(f"⚠️ 지진 감지! (시도 {attempt}/{MAX_RETRIES}): {e}")
             if attempt < MAX_RETRIES:
+                if on_retry is not None:
+                    on_retry(attempt, e)
                 await asyncio.sleep(2 ** attempt)
     raise RuntimeError(f"🏚️ 복구 실패 ({MAX_RETRIES}회 시도 후): {last_error}")
 
 
+class DeadlineExceeded(RuntimeError):
+    """공기 초과 (단계 또는 전체 제한 시간)"""
+
+
+async def run_with_deadline(stage: str, coro, task_deadline: float):
+    """
+    단계 제한 시간과 남은 전체 제한 시간 중 짧은 쪽으로 공정을 감시합니다.
+    시간이 지나면 공정 코루틴을 취소하고 DeadlineExceeded를 던집니다.
+    """
+    remaining = task_deadline - time.monotonic()
+    stage_limit = stage_deadlines().get(stage, remaining)
+    timeout = max(min(stage_limit, remaining), 0)
+    try:
+        return await asyncio.wait_for(coro, timeout=timeout)
+    except asyncio.TimeoutError:
+        scope = "단계" if stage_limit <= remaining else "전체 공정"
+        raise DeadlineExceeded(f"⏰ {scope} 제한 시간 초과 ({timeout:.0f}초)") from None
+
+
+# SDK(google-genai 1.14.0, requirements.txt 고정)에는 operations.cancel이 없어
+# 내부 API 클라이언트(_api_client.request)로 LRO 표준 ':cancel' 엔드포인트를 직접 호출합니다.
+# 비공개 API라 SDK를 올리면 조용히 깨질 수 있으므로, 검증한 버전에서만 사용합니다.
+# SDK를 올릴 때는 공개 cancel 지원 여부를 확인하고 이 목록을 함께 갱신하세요.
+PRIVATE_CANCEL_SDK_VERSIONS = ("1.14.0",)
+
+
+async def cancel_operation(client: genai.Client, operation) -> None:
+    """원격 Veo 작업 중단 요청 (가능한 경우에만)"""
+    name = getattr(operation, "name", None)
+    if not name:
+        return
+    cancel = getattr(client.operations, "cancel", None)
+    if cancel is None and genai.__version__ not in PRIVATE_CANCEL_SDK_VERSIONS:
+        print(
+            f"⚠️ google-genai {genai.__version__}에서는 원격 영상 작업 중단을 지원하지 않습니다. "
+            f"(서버에서 계속 진행됨: {name})"
+        )
+        return
+    try:
+        if cancel is not None:
+            await asyncio.to_thread(cancel, name=name)
+        else:
+            await asyncio.to_thread(client._api_client.request, "post", f"{name}:cancel", {})
+        print(f"🛑 원격 영상 작업 중단 요청: {name}")
+    except Exception as e:
+        print(f"⚠️ 원격 영상 작업 중단 실패 (서버에서 계속 진행될 수 있음): {e}")
+
+
 # ═══════════════════════════════════════════
 # Zone 1: 시장 조사 (Market Research)
 # ═══════════════════════════════════════════
+# 응답 품질 계기판 (프로세스별): 그대로 파싱 / 잘린 응답 복구 / 재시도한 호출 / 재시도 끝에 실패
+# 워커 모드에서는 워커가 물류 센터에 보고하고, API의 /metrics가 합산해서 보여줍니다.
+ZONE1_STATS = {"parsed": 0, "repaired": 0, "retried": 0, "failed": 0}
+
+
+def _close_json(fragment: str) -> str:
+    """열린 문자열/괄호를 닫아 잘린 JSON 조각을 완결된 형태로 만듭니다."""
+    stack = []
+    in_str = False
+    escaped = False
+    for ch in fragment:
+        if in_str:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if escaped:
+        fragment = fragment[:-1]
+    if in_str:
+        fragment += '"'
+    return fragment + "".join(reversed(stack))
+
+
+def _repair_json(text: str):
+    """
+    잘린(스트리밍 중단, 토큰 한도) JSON 응답 복구.
+    문자열 밖의 쉼표 위치를 뒤에서부터 잘라가며 파싱 가능한 가장 긴 접두사를 찾습니다.
+    """
+    text = text.strip()
+    cuts = [len(text)]
+    in_str = False
+    escaped = False
+    for i, ch in enumerate(text):
+        if in_str:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch == ",":
+            cuts.append(i)
+    for cut in [cuts[0]] + sorted(cuts[1:], reverse=True):
+        try:
+            return json.loads(_close_json(text[:cut]))
+        except json.JSONDecodeError:
+            continue
+    raise ValueError(f"JSON 복구 실패: {text[:100]}")
+
+
+def _stream_text(client: genai.Client, model: str, contents, config) -> str:
+    """스트리밍 응답을 모읍니다. 도중에 끊겨도 받은 만큼은 돌려줍니다."""
+    chunks = []
+    try:
+        for chunk in client.models.generate_content_stream(
+            model=model, contents=contents, config=config
+        ):
+            if chunk.text:
+                chunks.append(chunk.text)
+    except Exception as e:
+        if not chunks:
+            raise
+        print(f"⚠️ 스트리밍 중단, 받은 응답으로 복구 시도: {e}")
+    return "".join(chunks)
+
+
 async def zone1_market_research(client: genai.Client, keyword: str) -> dict:
     """
     Gemini 3 Flash로 트렌드 분석 및 제목/설명/태그 생성
+    응답 규격(MarketResearch)을 response_schema로 강제하고, 잘린 응답은 복구해서 씁니다.
     """
+    # 응답 모양과 필드별 조건은 response_schema(MarketResearch의 description)가 정하므로
+    # 프롬프트에는 역할과 과제만 적어 출력 토큰을 아낍니다.
     prompt = f"""당신은 유튜브 쇼츠 마케팅 전문가입니다.
-'{keyword}' 관련 제품 홍보 영상을 위한 다음 정보를 JSON 형식으로 생성하세요:
-
-{{
-  "title": "매력적인 한국어 제목 (50자 이내)",
-  "description": "SEO 최적화 한국어 설명 (200자 이내)",
-  "tags": ["태그1", "태그2", "태그3", "태그4", "태그5"],
-  "trend_summary": "현재 이 제품의 트렌드 요약 (100자 이내)",
-  "product_description": "영상에 사용할 제품 상세 설명 (영어, 50단어 이내)",
-  "scene_description": "제품을 보여줄 영상 장면 설명 (영어, 50단어 이내)"
-}}
-
-반드시 유효한 JSON만 출력하세요.
-"""
+'{keyword}' 관련 제품 홍보 영상의 제목, 설명, 태그, 트렌드 요약과
+영상 제작용 제품/장면 설명을 응답 규격의 각 필드 설명에 맞춰 작성하세요."""
+    config = types.GenerateContentConfig(
+        temperature=0.8,
+        response_mime_type="application/json",
+        response_schema=MarketResearch,
+        safety_settings=SAFETY_SETTINGS,
+    )
 
     async def _call():
-        response = await asyncio.to_thread(
-            client.models.generate_content,
-            model="gemini-3-flash-preview",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.8,
-                response_mime_type="application/json",
-                safety_settings=SAFETY_SETTINGS,
-            )
+        text = await asyncio.to_thread(
+            _stream_text, client, "gemini-3-flash-preview", prompt, config
         )
+        try:
+            data = json.loads(text)
+            repaired = False
+        except json.JSONDecodeError:
+            data = _repair_json(text)
+            repaired = True
+        # 복구해도 규격 미달이면 ValidationError → 재시도
+        metadata = MarketResearch.model_validate(data)
+        ZONE1_STATS["repaired" if repaired else "parsed"] += 1
+        return metadata.model_dump()
+
+    def _count_retry(attempt, error):
+        ZONE1_STATS["retried"] += 1
 
-        import json
-        return json.loads(response.text)
-
-    return await retry_async(_call)
+    try:
+        return await retry_async(_call, on_retry=_count_retry)
+    except Exception:
+        ZONE1_STATS["failed"] += 1
+        raise
 
 
 # ═══════════════════════════════════════════
@@ -217,22 +383,45 @@ async def zone3_synthesize_image(
 # ═══════════════════════════════════════════
 # Zone 4: 방송국 (Broadcasting - Veo 3.1)
 # ═══════════════════════════════════════════
+DEFAULT_VARIANTS = [{"aspect_ratio": "9:16", "takes": 1}]
+
+
+def _variant_filename(task_id: str, aspect_ratio: str, take: int) -> str:
+    """변형별 완제품 파일명 (예: abc123_final_9x16_1.mp4)"""
+    return f"{task_id}_final_{aspect_ratio.replace(':', 'x')}_{take}.mp4"
+
+
+def _load_png_bytes(path: str) -> bytes:
+    img = Image.open(path)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _write_file(path: Path, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
+
+
 async def zone4_generate_video(
     client: genai.Client,
     synthesized_image_path: str,
     scene_desc: str,
     video_hint: str,
-    task_id: str
-) -> str:
+    task_id: str,
+    variants: Optional[list[dict]] = None,
+) -> list[dict]:
     """
     Veo 3.1로 영상 생성 (Polling 시스템)
-    Returns: 저장된 영상 파일 경로
+    variants: [{"aspect_ratio": "9:16", "takes": 2}, ...] - 화면비별로 몇 편을 찍을지
+    화면비마다 number_of_videos로 묶어 요청하고(환경 변수 VEO_MAX_VIDEOS_PER_REQUEST까지),
+    모든 요청과 다운로드를 동시에 진행합니다.
+    Returns: [{"aspect_ratio", "take", "path"}, ...]
     """
-    # 합성 이미지 로드
-    synth_img = Image.open(synthesized_image_path)
-    synth_bytes = io.BytesIO()
-    synth_img.save(synth_bytes, format="PNG")
-    synth_bytes = synth_bytes.getvalue()
+    variants = variants or DEFAULT_VARIANTS
+
+    # 합성 이미지 로드 (모든 변형이 공유)
+    synth_bytes = await asyncio.to_thread(_load_png_bytes, synthesized_image_path)
 
     video_prompt = f"""Create a cinematic 8-second product advertisement video.
 Scene: {scene_desc}
@@ -240,7 +429,7 @@ Camera: {video_hint}
 Style: Professional, smooth transitions, high production value.
 The person should naturally interact with the product."""
 
-    async def _call():
+    async def _call(aspect_ratio: str, first_take: int, count: int):
         # Veo 3.1 영상 생성 요청
         operation = await asyncio.to_thread(
             client.models.generate_videos,
@@ -251,35 +440,34 @@ The person should naturally interact with the product."""
                 mime_type="image/png"
             ),
             config=types.GenerateVideosConfig(
-                aspect_ratio="9:16",
-                number_of_videos=1,
+                aspect_ratio=aspect_ratio,
+                number_of_videos=count,
             )
         )
 
-
-
         # Polling: 영상 생성 완료까지 대기
-        print("📡 영상 송출 대기 중...")
-        while not operation.done:
-            await asyncio.sleep(20)  # Polling 간격 20초로 증가 (429 방지)
-            
-            async def _check():
-                return await asyncio.to_thread(
-                    client.operations.get,
-                    operation=operation
-                )
-            
-            try:
-                operation = await retry_async(_check)
-                print(f"📡 영상 송출 대기 중... (ID: {task_id})")
-            except Exception as e:
-                print(f"⚠️ 폴링 중 지진 감지 (무시하고 재시도): {e}")
-                continue
-
-
-        # 영상 다운로드
-        video_path = OUTPUTS_DIR / f"{task_id}_final.mp4"
-        
+        print(f"📡 영상 송출 대기 중... ({aspect_ratio} x{count})")
+        try:
+            while not operation.done:
+                await asyncio.sleep(20)  # Polling 간격 20초로 증가 (429 방지)
+
+                async def _check():
+                    return await asyncio.to_thread(
+                        client.operations.get,
+                        operation=operation
+                    )
+
+                try:
+                    operation = await retry_async(_check)
+                    print(f"📡 영상 송출 대기 중... (ID: {task_id}, {aspect_ratio})")
+                except Exception as e:
+                    print(f"⚠️ 폴링 중 지진 감지 (무시하고 재시도): {e}")
+                    continue
+        except asyncio.CancelledError:
+            # 취소/공기 초과: 원격 작업도 멈춰 할당량 낭비를 막음
+            await cancel_operation(client, operation)
+            raise
+
         res = operation.result
         if not res:
             error_msg = f"API Error: {operation.error}" if operation.error else "No result data"
@@ -287,7 +475,7 @@ The person should naturally interact with the product."""
 
         # 다양한 필드명 대응 (generated_videos 또는 videos)
         videos = getattr(res, 'generated_videos', None) or getattr(res, 'videos', None)
-        
+
         if not videos:
             # 혹시 res 자체가 리스트인 경우 (일부 SDK 버전)
             if isinstance(res, list):
@@ -295,25 +483,57 @@ The person should naturally interact with the product."""
             else:
                 raise RuntimeError(f"영상이 생성되었으나 비디오 목록을 찾을 수 없습니다. (Type: {type(res)}, Data: {res})")
 
-        for video in videos:
-            # video.video 추출
-            video_part = getattr(video, 'video', None)
-            if not video_part:
-                continue
+        # video.video 추출
+        video_parts = [getattr(video, 'video', None) for video in videos]
+        video_parts = [part for part in video_parts if part][:count]
+        if not video_parts:
+            raise RuntimeError("영상 목록은 있으나 다운로드 가능한 비디오 데이터가 없습니다.")
+        if len(video_parts) < count:
+            # 일부만 돌아오면 이 묶음을 다시 요청 (빠진 촬영분을 조용히 버리지 않음)
+            raise RuntimeError(
+                f"요청한 영상 {count}편 중 {len(video_parts)}편만 생성되었습니다. ({aspect_ratio})"
+            )
 
+        # 영상 다운로드 (동시 진행)
+        async def _download(take: int, video_part):
+            video_path = OUTPUTS_DIR / _variant_filename(task_id, aspect_ratio, take)
             video_data = await asyncio.to_thread(
                 client.files.download,
                 file=video_part
             )
-            with open(video_path, "wb") as f:
-                f.write(video_data)
+            await asyncio.to_thread(_write_file, video_path, video_data)
             print(f"🎬 영상 송출 완료: {video_path}")
-            return str(video_path)
-
-        raise RuntimeError("영상 목록은 있으나 다운로드 가능한 비디오 데이터가 없습니다.")
-
+            return {"aspect_ratio": aspect_ratio, "take": take, "path": str(video_path)}
+
+        return await asyncio.gather(*(
+            _download(first_take + i, part) for i, part in enumerate(video_parts)
+        ))
+
+    # 같은 화면비는 촬영 수를 합침 (파일명이 화면비+촬영 번호로 정해지므로)
+    takes_by_ratio: dict[str, int] = {}
+    for variant in variants:
+        ratio = variant["aspect_ratio"]
+        takes_by_ratio[ratio] = takes_by_ratio.get(ratio, 0) + variant.get("takes", 1)
+
+    # 화면비별 촬영 분량을 요청 단위로 나눔
+    per_request = veo_max_videos_per_request()
+    batches = []
+    for ratio, takes in takes_by_ratio.items():
+        for start in range(0, takes, per_request):
+            count = min(per_request, takes - start)
+            batches.append((ratio, start + 1, count))
+
+    jobs = [asyncio.create_task(retry_async(_call, *batch)) for batch in batches]
+    try:
+        results = await asyncio.gather(*jobs)
+    except BaseException:
+        # 하나라도 실패/취소되면 나머지 촬영도 중단
+        for job in jobs:
+            job.cancel()
+        await asyncio.gather(*jobs, return_exceptions=True)
+        raise
 
-    return await retry_async(_call)
+    return [item for batch in results for item in batch]
 
 
 # ═══════════════════════════════════════════
@@ -325,38 +545,55 @@ async def run_full_pipeline(
     character_image_path: Optional[str],
     style_prompt: str,
     video_hint: str,
-    progress_callback=None
+    progress_callback=None,
+    deadline_seconds: Optional[float] = None,
+    variants: Optional[list[dict]] = None,
 ) -> dict:
     """
     4단계 전체 공정 실행
+    Zone 1~3은 한 번만 돌리고, Zone 4에서 variants(화면비/촬영 수)만큼 영상을 나눠 찍습니다.
+    deadline_seconds(기본 환경 변수 TASK_DEADLINE_SECONDS) 안에 끝나지 않으면 실패 처리하고,
+    작업이 취소되면 진행 중 단계를 'cancelled'로 보고한 뒤 CancelledError를 다시 던집니다.
     """
     client = get_client()
+    task_deadline = time.monotonic() + (deadline_seconds or task_deadline_seconds())
     result = {
         "task_id": task_id,
         "stages": {},
         "final_video_url": None,
+        "variants": [],
         "metadata": None,
     }
 
-    async def update(stage: str, status: str, msg: str, output_url=None):
+    async def update(stage: str, status: str, msg: str, output_url=None, variants=None):
         result["stages"][stage] = {
             "status": status, "message": msg, "output_url": output_url
         }
         if progress_callback:
-            await progress_callback(task_id, stage, status, msg, output_url)
+            await progress_callback(task_id, stage, status, msg, output_url, variants)
+
+    def running_stage() -> str:
+        for s in ["video_generation", "image_synthesis", "image_generation", "market_research"]:
+            if s in result["stages"] and result["stages"][s]["status"] == "running":
+                return s
+        return "unknown"
 
     try:
         # ── Zone 1: 시장 조사 ──
         await update("market_research", "running", "🔍 트렌드를 분석하고 있습니다...")
-        metadata = await zone1_market_research(client, keyword)
+        metadata = await run_with_deadline(
+            "market_research", zone1_market_research(client, keyword), task_deadline
+        )
         result["metadata"] = metadata
         await update("market_research", "completed", "✅ 시장 조사 완료!", None)
 
         # ── Zone 2: 자재 생산 ──
         await update("image_generation", "running", "🎨 제품 이미지를 생성하고 있습니다...")
-        product_desc = metadata.get("product_description", keyword)
-        product_image_path = await zone2_generate_product_image(
-            client, product_desc, style_prompt, task_id
+        product_desc = metadata["product_description"]
+        product_image_path = await run_with_deadline(
+            "image_generation",
+            zone2_generate_product_image(client, product_desc, style_prompt, task_id),
+            task_deadline,
         )
         product_url = f"/outputs/{task_id}_product.png"
         await update("image_generation", "completed", "✅ 제품 이미지 생성 완료!", product_url)
@@ -364,9 +601,13 @@ async def run_full_pipeline(
         # ── Zone 3: 합성 연구소 ──
         if character_image_path and os.path.exists(character_image_path):
             await update("image_synthesis", "running", "🧬 캐릭터와 제품을 합성하고 있습니다...")
-            scene_desc = metadata.get("scene_description", "person presenting product")
-            synth_path = await zone3_synthesize_image(
-                client, character_image_path, product_image_path, scene_desc, task_id
+            scene_desc = metadata["scene_description"]
+            synth_path = await run_with_deadline(
+                "image_synthesis",
+                zone3_synthesize_image(
+                    client, character_image_path, product_image_path, scene_desc, task_id
+                ),
+                task_deadline,
             )
             synth_url = f"/outputs/{task_id}_synthesized.png"
             await update("image_synthesis", "completed", "✅ 이미지 합성 완료!", synth_url)
@@ -377,22 +618,42 @@ async def run_full_pipeline(
             await update("image_synthesis", "skipped", "⏭️ 캐릭터 없이 진행합니다.", synth_url)
 
         # ── Zone 4: 방송국 ──
-        await update("video_generation", "running", "🎬 영상을 생성하고 있습니다... (2~5분 소요)")
-        scene_desc = metadata.get("scene_description", "cinematic product showcase")
-        video_path = await zone4_generate_video(
-            client, synth_path, scene_desc, video_hint, task_id
+        variants = variants or DEFAULT_VARIANTS
+        total_takes = sum(v.get("takes", 1) for v in variants)
+        await update(
+            "video_generation", "running",
+            f"🎬 영상 {total_takes}편을 생성하고 있습니다... (2~5분 소요)",
+        )
+        scene_desc = metadata["scene_description"]
+        videos = await run_with_deadline(
+            "video_generation",
+            zone4_generate_video(
+                client, synth_path, scene_desc, video_hint, task_id, variants
+            ),
+            task_deadline,
         )
-        video_url = f"/outputs/{task_id}_final.mp4"
+        result["variants"] = [
+            {
+                "aspect_ratio": v["aspect_ratio"],
+                "take": v["take"],
+                "url": f"/outputs/{Path(v['path']).name}",
+            }
+            for v in videos
+        ]
+        video_url = result["variants"][0]["url"]
         result["final_video_url"] = video_url
-        await update("video_generation", "completed", "✅ 영상 생성 완료! 🎉", video_url)
+        await update(
+            "video_generation", "completed", "✅ 영상 생성 완료! 🎉", video_url,
+            variants=result["variants"],
+        )
+
+    except asyncio.CancelledError:
+        await update(running_stage(), "cancelled", "🛑 공사가 취소되었습니다.")
+        raise
 
     except Exception as e:
-        current_stage = "unknown"
-        for s in ["video_generation", "image_synthesis", "image_generation", "market_research"]:
-            if s in result["stages"] and result["stages"][s]["status"] == "running":
-                current_stage = s
-                break
-        
+        current_stage = running_stage()
+
         # 에러 메시지 고도화
         error_msg = str(e)
         advice = ""
@@ -0,0 +1,260 @@
+"""
+🩺 AI City Builders - 관제 의료실 (Event Loop Watchdog)
+이벤트 루프가 막히면 모든 요청(/status 포함)이 함께 멈춥니다.
+루프 지연(lag)을 재고, 임계값보다 오래 루프를 붙잡은 콜백의 스택을 기록합니다.
+
+- LoopWatchdog: 루프 안의 심박 태스크 + 루프 밖의 감시 스레드
+  (루프가 멈춘 동안에도 감시 스레드가 루프 스레드의 스택을 떠 둡니다)
+- InstrumentedThreadPoolExecutor: asyncio.to_thread가 쓰는 기본 실행기 계측
+  (대기열 깊이, 사용 중 스레드 수, 이용률)
+
+운영 중에도 켜고 끌 수 있도록 설계했으며, 꺼져 있을 때는 비용이 없습니다.
+감시기는 프로세스마다 하나씩이므로(gunicorn 워커, 파이프라인 워커), 켜고 끄는 명령은
+제어 파일(LOOP_WATCHDOG_CONTROL_PATH)에 기록하고 각 프로세스가 follow_control()로 따라갑니다.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+LOOP_WATCHDOG_ENABLED = os.getenv("LOOP_WATCHDOG", "0") == "1"
+LOOP_WATCHDOG_THRESHOLD_MS = float(os.getenv("LOOP_WATCHDOG_THRESHOLD_MS", "200"))
+THREAD_POOL_MAX_WORKERS = os.getenv("THREAD_POOL_MAX_WORKERS")
+# 같은 호스트의 모든 프로세스가 공유하는 켜기/끄기 제어 파일
+LOOP_WATCHDOG_CONTROL_PATH = os.getenv(
+    "LOOP_WATCHDOG_CONTROL_PATH",
+    os.path.join(tempfile.gettempdir(), "ai-city-builders-watchdog.json"),
+)
+LOOP_WATCHDOG_CONTROL_POLL_SECONDS = float(os.getenv("LOOP_WATCHDOG_CONTROL_POLL_SECONDS", "2"))
+
+
+class LoopWatchdog:
+    """이벤트 루프 심박 측정기 + 막힘 감지기"""
+
+    def __init__(self, threshold_ms: float = LOOP_WATCHDOG_THRESHOLD_MS, interval: float = 0.1):
+        self.threshold_ms = threshold_ms
+        self.interval = interval
+        self.enabled = False
+        self._loop_thread_id: Optional[int] = None
+        self._last_tick = time.monotonic()
+        self._ticker: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._open_stall: Optional[dict] = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.samples = 0
+        self.total_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.last_lag_ms = 0.0
+        self.stalls = 0
+        self.recent_stalls: deque = deque(maxlen=20)
+        self._open_stall = None
+
+    def start(self, threshold_ms: Optional[float] = None):
+        """감시 시작 (이벤트 루프 안에서 호출)"""
+        if threshold_ms is not None:
+            self.threshold_ms = threshold_ms
+        if self.enabled:
+            return
+        self._reset_stats()
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stop = threading.Event()
+        self._ticker = asyncio.get_running_loop().create_task(self._tick())
+        threading.Thread(
+            target=self._detect, args=(self._stop,), name="loop-watchdog", daemon=True
+        ).start()
+        self.enabled = True
+        print(f"🩺 루프 감시 시작 (임계값 {self.threshold_ms:.0f}ms)")
+
+    def stop(self):
+        """감시 중지"""
+        if not self.enabled:
+            return
+        self._stop.set()
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
+        self.enabled = False
+        print("🩺 루프 감시 중지")
+
+    async def _tick(self):
+        """루프 심박: 예정보다 늦게 깨어난 만큼이 루프 지연"""
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag_ms = max((now - started - self.interval) * 1000, 0.0)
+            with self._lock:
+                self._last_tick = now
+                stall, self._open_stall = self._open_stall, None
+            if stall is not None:
+                # 루프가 풀린 뒤에야 실제로 막혀 있던 시간을 알 수 있음
+                stall["blocked_ms"] = round(lag_ms, 1)
+                stall["ongoing"] = False
+                print(f"🐢 이벤트 루프 막힘 해소: 총 {lag_ms:.0f}ms")
+            self.samples += 1
+            self.total_lag_ms += lag_ms
+            self.last_lag_ms = lag_ms
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+
+    def _detect(self, stop: threading.Event):
+        """감시 스레드: 심박이 끊기면 루프 스레드의 현재 스택을 기록"""
+        reported_tick = None
+        while not stop.wait(self.threshold_ms / 2000):
+            tick = self._last_tick
+            blocked_ms = (time.monotonic() - tick - self.interval) * 1000
+            if blocked_ms < self.threshold_ms or tick == reported_tick:
+                continue
+            reported_tick = tick
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(스택 없음)"
+            # blocked_ms는 감지 시점의 하한값이며, 루프가 풀리면 실제 값으로 갱신됨
+            stall = {
+                "at": time.time(),
+                "blocked_ms": round(blocked_ms, 1),
+                "ongoing": True,
+                "stack": stack,
+            }
+            with self._lock:
+                if self._last_tick != tick:
+                    continue  # 스택을 뜨는 사이 루프가 이미 풀림
+                self._open_stall = stall
+                self.stalls += 1
+                self.recent_stalls.append(stall)
+            print(f"🐢 이벤트 루프가 {blocked_ms:.0f}ms 이상 막혔습니다:\n{stack}")
+
+    def snapshot(self) -> dict:
+        """계기판 값"""
+        return {
+            "pid": os.getpid(),
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold_ms,
+            "samples": self.samples,
+            "avg_lag_ms": round(self.total_lag_ms / self.samples, 2) if self.samples else 0.0,
+            "max_lag_ms": round(self.max_lag_ms, 2),
+            "last_lag_ms": round(self.last_lag_ms, 2),
+            "stalls": self.stalls,
+            "recent_stalls": list(self.recent_stalls),
+        }
+
+
+class InstrumentedThreadPoolExecutor(ThreadPoolExecutor):
+    """asyncio.to_thread 오프로드 현황을 세는 기본 실행기"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._counter_lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._counter_lock:
+            self.queued += 1
+        started = False
+
+        def _run():
+            nonlocal started
+            with self._counter_lock:
+                started = True
+                self.queued -= 1
+                self.active += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._counter_lock:
+                    self.active -= 1
+                    self.completed += 1
+
+        future = super().submit(_run)
+
+        def _on_done(f):
+            # 실행 전에 취소된 작업은 대기열에서 빼줌
+            with self._counter_lock:
+                if f.cancelled() and not started:
+                    self.queued -= 1
+
+        future.add_done_callback(_on_done)
+        return future
+
+    def snapshot(self) -> dict:
+        with self._counter_lock:
+            return {
+                "max_workers": self._max_workers,
+                "threads": len(self._threads),
+                "active": self.active,
+                "queued": self.queued,
+                "completed": self.completed,
+                "utilization": round(self.active / self._max_workers, 3),
+            }
+
+
+watchdog = LoopWatchdog()
+thread_pool: Optional[InstrumentedThreadPoolExecutor] = None
+_applied_control: Optional[float] = None
+
+
+def apply_control(control: dict) -> None:
+    """제어 명령을 이 프로세스의 감시기에 반영 (이벤트 루프 안에서 호출)"""
+    global _applied_control
+    _applied_control = control.get("updated_at")
+    watchdog.stop()
+    if control.get("enabled"):
+        watchdog.start(threshold_ms=control.get("threshold_ms"))
+
+
+def publish_control(enabled: bool, threshold_ms: Optional[float] = None) -> dict:
+    """
+    제어 명령을 파일에 기록합니다. 기록한 프로세스는 apply_control()로 바로 반영하고,
+    다른 프로세스는 follow_control()이 다음 확인 주기에 따라옵니다.
+    """
+    control = {"enabled": enabled, "threshold_ms": threshold_ms, "updated_at": time.time()}
+    tmp_path = f"{LOOP_WATCHDOG_CONTROL_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(control, f)
+    os.replace(tmp_path, LOOP_WATCHDOG_CONTROL_PATH)  # 읽는 쪽이 반쯤 쓴 파일을 보지 않도록
+    return control
+
+
+def _read_control() -> Optional[dict]:
+    try:
+        with open(LOOP_WATCHDOG_CONTROL_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+async def follow_control(poll_seconds: float = LOOP_WATCHDOG_CONTROL_POLL_SECONDS):
+    """제어 파일을 주기적으로 확인해 다른 프로세스에서 내린 명령을 따라감"""
+    while True:
+        control = _read_control()
+        if control is not None and control.get("updated_at") != _applied_control:
+            print(f"🩺 루프 감시 제어 명령 수신 (pid {os.getpid()}): enabled={control.get('enabled')}")
+            apply_control(control)
+        await asyncio.sleep(poll_seconds)
+
+
+def install_thread_pool(loop: asyncio.AbstractEventLoop) -> InstrumentedThreadPoolExecutor:
+    """현재 루프의 기본 실행기를 계측 실행기로 교체"""
+    global thread_pool
+    max_workers = int(THREAD_POOL_MAX_WORKERS) if THREAD_POOL_MAX_WORKERS else None
+    thread_pool = InstrumentedThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="to-thread"
+    )
+    loop.set_default_executor(thread_pool)
+    return thread_pool
+
+
+def thread_pool_snapshot() -> Optional[dict]:
+    return thread_pool.snapshot() if thread_pool is not None else None
@@ -0,0 +1,58 @@
+"""
+📋 AI City Builders - 공사 일지 (Task State)
+API 서버(인메모리)와 워커(브로커) 양쪽이 같은 방식으로 공사 현황을 기록하도록
+작업 레코드의 모양과 갱신 규칙을 한곳에 모아둔 장부입니다.
+"""
+
+from schemas import PipelineStage
+
+STAGE_ORDER = ["market_research", "image_generation", "image_synthesis", "video_generation"]
+
+STAGE_MAP = {
+    "market_research": PipelineStage.MARKET_RESEARCH,
+    "image_generation": PipelineStage.IMAGE_GENERATION,
+    "image_synthesis": PipelineStage.IMAGE_SYNTHESIS,
+    "video_generation": PipelineStage.VIDEO_GENERATION,
+}
+
+
+def new_task_record() -> dict:
+    """새 공사 현장 레코드"""
+    return {
+        "current_stage": PipelineStage.IDLE,
+        "progress": 0,
+        "stages": {},
+        "final_video_url": None,
+        "variants": [],
+        "metadata": None,
+    }
+
+
+def apply_progress(task: dict, stage, status, message, output_url=None, variants=None) -> None:
+    """공사 현황 한 건을 레코드에 반영하고 진행률을 다시 계산합니다."""
+    task["stages"][stage] = {
+        "stage": stage,
+        "status": status,
+        "message": message,
+        "output_url": output_url,
+    }
+    # 진행률 계산
+    completed = sum(
+        1 for s in STAGE_ORDER
+        if s in task["stages"]
+        and task["stages"][s]["status"] in ("completed", "skipped")
+    )
+    task["progress"] = int((completed / len(STAGE_ORDER)) * 100)
+
+    if variants is not None:
+        task["variants"] = variants
+
+    if status == "completed" and stage == "video_generation":
+        task["current_stage"] = PipelineStage.COMPLETED
+        task["final_video_url"] = output_url
+    elif status == "failed":
+        task["current_stage"] = PipelineStage.FAILED
+    elif status == "cancelled":
+        task["current_stage"] = PipelineStage.CANCELLED
+    elif status == "running":
+        task["current_stage"] = STAGE_MAP.get(stage, PipelineStage.IDLE)
@@ -0,0 +1,206 @@
+"""
+🏭 AI City Builders - 공장 (Pipeline Worker)
+물류 센터(Broker)에서 작업 지시서를 임대받아 4단계 공정을 돌리는 독립 프로세스입니다.
+API 서버와 분리되어 있으므로 코어 단위로 자유롭게 증설할 수 있습니다.
+(기본 SQLite 물류 센터는 한 호스트 안에서만 공유됩니다. 여러 노드는 다른 Broker 구현 필요)
+
+실행: python worker.py
+  - WORKER_CONCURRENCY: 프로세스당 동시 작업 수 (기본 1)
+  - WORKER_LEASE_SECONDS: 임대 기간 (기본 60초)
+  - WORKER_POLL_SECONDS: 대기열이 비었을 때 확인 간격 (기본 2초)
+  - WORKER_DRAIN_TIMEOUT: 종료 신호 후 진행 중 작업을 기다리는 시간 (기본 900초)
+
+API에서 취소를 요청하면 다음 heartbeat에서 공정을 중단하고 슬롯을 바로 비웁니다.
+SIGTERM/SIGINT를 받으면 새 작업을 받지 않고 진행 중인 작업을 마무리한 뒤 종료합니다(drain).
+제한 시간 안에 끝나지 않은 작업은 대기열로 반납되어 다른 워커가 이어받습니다.
+"""
+
+import os
+import signal
+import socket
+import asyncio
+import uuid
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from services.broker import get_broker, Broker, Job  # noqa: E402
+from services.google_ai import run_full_pipeline, ZONE1_STATS  # noqa: E402
+from services.loop_monitor import (  # noqa: E402
+    watchdog, install_thread_pool, follow_control, LOOP_WATCHDOG_ENABLED
+)
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "1"))
+WORKER_LEASE_SECONDS = float(os.getenv("WORKER_LEASE_SECONDS", "60"))
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "2"))
+WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", "900"))
+
+
+class Worker:
+    """작업 지시서를 받아 공정을 돌리는 공장장"""
+
+    def __init__(self, broker: Broker, concurrency: int = WORKER_CONCURRENCY):
+        self.broker = broker
+        self.concurrency = concurrency
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.draining = asyncio.Event()
+        self.running: dict[str, asyncio.Task] = {}
+        self.slot_freed = asyncio.Event()
+
+    async def _heartbeat(self, job: Job, pipeline: asyncio.Task, stop_requested: asyncio.Event):
+        """임대 연장. 임대를 잃거나(다른 워커가 가져감) 취소 요청이 오면 공정을 중단합니다."""
+        while not pipeline.done():
+            await asyncio.sleep(WORKER_LEASE_SECONDS / 3)
+            try:
+                alive = await asyncio.to_thread(
+                    self.broker.heartbeat, job.job_id, self.worker_id, WORKER_LEASE_SECONDS
+                )
+            except Exception as e:
+                print(f"⚠️ 임대 연장 실패 (다음 주기에 재시도): {e}")
+                continue
+            if not alive:
+                print(f"🚫 임대 상실 또는 취소 요청, 공정 중단: {job.job_id}")
+                stop_requested.set()
+                pipeline.cancel()
+                return
+
+    async def _process(self, job: Job):
+        """작업 하나를 처리하고 결과를 물류 센터에 보고"""
+        print(f"🏗️ 작업 착수: {job.job_id} (시도 {job.attempts}, 워커 {self.worker_id})")
+        stop_requested = asyncio.Event()
+
+        char_path = job.payload.get("character_image_path")
+        if char_path and not os.path.exists(char_path):
+            # 업로드된 캐릭터가 이 워커에서 보이지 않으면 합성을 건너뛰지 말고 실패 처리
+            message = f"🚨 캐릭터 이미지를 찾을 수 없습니다: {char_path}"
+            try:
+                await asyncio.to_thread(
+                    self.broker.publish_progress,
+                    job.job_id, self.worker_id, "image_synthesis", "failed", message,
+                )
+                await asyncio.to_thread(self.broker.fail, job.job_id, self.worker_id, message)
+            except Exception as e:
+                print(f"⚠️ 실패 보고 실패: {e}")
+            print(f"🚨 작업 중단: {job.job_id}: {message}")
+            self.running.pop(job.job_id, None)
+            self.slot_freed.set()
+            return
+
+        async def progress_callback(
+            task_id, stage, status, message, output_url=None, variants=None
+        ):
+            if status == "cancelled" and not stop_requested.is_set():
+                # drain 시간 초과로 중단된 작업은 반납될 뿐 취소가 아님
+                return
+            await asyncio.to_thread(
+                self.broker.publish_progress,
+                task_id, self.worker_id, stage, status, message, output_url, variants,
+            )
+
+        pipeline = asyncio.create_task(run_full_pipeline(
+            task_id=job.job_id,
+            keyword=job.payload["keyword"],
+            character_image_path=char_path,
+            style_prompt=job.payload["style_prompt"],
+            video_hint=job.payload["video_hint"],
+            progress_callback=progress_callback,
+            deadline_seconds=job.payload.get("deadline_seconds"),
+            variants=job.payload.get("variants"),
+        ))
+        heartbeat = asyncio.create_task(self._heartbeat(job, pipeline, stop_requested))
+        try:
+            result = await pipeline
+            await asyncio.to_thread(
+                self.broker.complete, job.job_id, self.worker_id, result.get("metadata")
+            )
+            print(f"✅ 작업 완료: {job.job_id}")
+        except asyncio.CancelledError:
+            # 취소 요청이면 취소로 마감, drain 시간 초과면 대기열로 반납
+            # (임대를 이미 잃었다면 아무 일도 하지 않음)
+            await asyncio.to_thread(self.broker.release, job.job_id, self.worker_id)
+            print(f"↩️ 작업 반납: {job.job_id}")
+        except Exception as e:
+            await asyncio.to_thread(self.broker.fail, job.job_id, self.worker_id, str(e))
+            print(f"🚨 공정 중 지진 발생: {job.job_id}: {e}")
+        finally:
+            heartbeat.cancel()
+            self.running.pop(job.job_id, None)
+            self.slot_freed.set()
+            await self._publish_metrics()
+
+    async def _publish_metrics(self):
+        """이 워커의 계기판 값을 물류 센터에 보고 (API의 /metrics에서 합산)"""
+        try:
+            await asyncio.to_thread(
+                self.broker.publish_metrics, self.worker_id, {"zone1": dict(ZONE1_STATS)}
+            )
+        except Exception as e:
+            print(f"⚠️ 계기판 보고 실패: {e}")
+
+    async def run(self):
+        """대기열 감시 루프"""
+        print(f"🏭 공장 가동: {self.worker_id} (동시 작업 {self.concurrency}개)")
+        while not self.draining.is_set():
+            if len(self.running) >= self.concurrency:
+                # 슬롯이 비는 즉시 다음 작업을 받음
+                self.slot_freed.clear()
+                try:
+                    await asyncio.wait_for(self.slot_freed.wait(), timeout=WORKER_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                job = await asyncio.to_thread(
+                    self.broker.claim, self.worker_id, WORKER_LEASE_SECONDS
+                )
+            except Exception as e:
+                print(f"⚠️ 물류 센터 연결 실패: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.draining.wait(), timeout=WORKER_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.running[job.job_id] = asyncio.create_task(self._process(job))
+
+        await self.drain()
+
+    async def drain(self):
+        """진행 중인 작업을 마무리하고, 제한 시간을 넘기면 반납"""
+        if not self.running:
+            print("🏭 공장 가동 중지. 안녕히!")
+            return
+        print(f"⏳ 진행 중인 작업 {len(self.running)}개 마무리 중...")
+        tasks = list(self.running.values())
+        _, pending = await asyncio.wait(tasks, timeout=WORKER_DRAIN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        print("🏭 공장 가동 중지. 안녕히!")
+
+
+async def main():
+    worker = Worker(get_broker())
+    loop = asyncio.get_running_loop()
+    install_thread_pool(loop)
+    if LOOP_WATCHDOG_ENABLED:
+        watchdog.start()
+    # API의 POST /admin/watchdog 명령을 제어 파일로 전달받음
+    watchdog_control = asyncio.create_task(follow_control())
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, worker.draining.set)
+        except NotImplementedError:
+            # Windows: add_signal_handler 미지원
+            signal.signal(sig, lambda *_: loop.call_soon_threadsafe(worker.draining.set))
+    try:
+        await worker.run()
+    finally:
+        watchdog_control.cancel()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
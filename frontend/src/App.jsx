@@ -83,6 +83,10 @@ export default function App() {
                     setError('🚨 공정 중 지진이 발생했습니다. 다시 시도해주세요.')
                     setIsGenerating(false)
                     clearInterval(pollingRef.current)
+                } else if (data.current_stage === 'cancelled') {
+                    setError('🛑 공사가 취소되었습니다.')
+                    setIsGenerating(false)
+                    clearInterval(pollingRef.current)
                 }
             } catch (err) {
                 console.error('Polling error:', err)